@@ -16,6 +16,7 @@ CONFIG = {
     'db_filename': 'scraped_data.db',
     'model_name': 'gemini-2.0-flash',
     'max_text_length_per_article': 16000,
+    'min_text_length_per_article': 100,  # Shorter articles are never sent, so they are never selected
     'DB_PROCESSING_LIMIT': 200,          # Max articles to fetch from DB in one script run
     'TOKEN_BUDGET_PER_BATCH': 100000,    # Target token count for one API call (safely below 250k limit)
     'CHARS_PER_TOKEN_ESTIMATE': 4,       # Standard estimation: 1 token ~ 4 chars
@@ -68,7 +69,10 @@ PROMPT_TEMPLATE = """
 # --- End of Configuration ---
 
 def setup_database(cursor: sqlite3.Cursor):
-    """Ensures all required metadata columns exist in the database."""
+    """
+    Ensures all required metadata columns exist in the database, plus the
+    text_length column, its triggers and the partial index over pending rows.
+    """
     logging.info("Verifying database schema...")
     for column, col_type in CONFIG['db_metadata_columns'].items():
         try:
@@ -77,12 +81,40 @@ def setup_database(cursor: sqlite3.Cursor):
         except sqlite3.OperationalError as e:
             if "duplicate column name" not in str(e):
                 logging.error(f"DB error adding column '{column}': {e}", exc_info=True)
+
+    # Precomputed pagetext length so batches can be planned without reading any text.
+    try:
+        cursor.execute("ALTER TABLE scraped_content ADD COLUMN text_length INTEGER")
+        logging.info("Added 'text_length' column to the database.")
+    except sqlite3.OperationalError as e:
+        if "duplicate column name" not in str(e):
+            logging.error(f"DB error adding column 'text_length': {e}", exc_info=True)
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS scraped_content_text_length_insert
+                      AFTER INSERT ON scraped_content BEGIN
+                          UPDATE scraped_content SET text_length = coalesce(length(NEW.pagetext), 0) WHERE rowid = NEW.rowid;
+                      END""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS scraped_content_text_length_update
+                      AFTER UPDATE OF pagetext ON scraped_content BEGIN
+                          UPDATE scraped_content SET text_length = coalesce(length(NEW.pagetext), 0) WHERE rowid = NEW.rowid;
+                      END""")
+
+    # Partial index holding only unanalyzed rows; it covers the work query, so
+    # picking the next batch never touches the table itself.
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_scraped_content_pending
+                      ON scraped_content(text_length) WHERE technical_depth IS NULL""")
+
+    # Backfill on every run so an interrupted first backfill is finished later;
+    # once lengths are filled in this is a cheap lookup on the partial index.
+    # A NULL pagetext gets length 0 so it is not matched again on every run.
+    cursor.execute("""UPDATE scraped_content SET text_length = coalesce(length(pagetext), 0)
+                      WHERE text_length IS NULL AND technical_depth IS NULL""")
     logging.info("Database schema verification complete.")
 
 def create_dynamic_batches(rows: list, token_budget: int) -> list:
     """
     Creates batches of articles based on a total token budget per batch.
     Uses a greedy approach to pack as many articles as possible into each batch.
+    Expects (rowid, text_length) rows, so no article text is needed for planning.
     """
     batches = []
     current_batch = []
@@ -91,11 +123,15 @@ def create_dynamic_batches(rows: list, token_budget: int) -> list:
     current_batch_tokens = prompt_overhead_tokens
 
     for row in rows:
-        _, _, text = row
-        text_content = text if isinstance(text, str) else ""
+        _, text_length = row
+        # Only the truncated text is ever sent, so size articles by that.
+        # An unknown length is costed as the worst case so batches never overshoot the budget.
+        if text_length is None:
+            text_length = CONFIG['max_text_length_per_article']
+        text_length = min(text_length, CONFIG['max_text_length_per_article'])
 
         # Estimate tokens for this article's content + its specific wrapper (e.g., "--- ARTICLE article_123 ---")
-        article_tokens = (len(text_content) // CONFIG['CHARS_PER_TOKEN_ESTIMATE']) + 20
+        article_tokens = (text_length // CONFIG['CHARS_PER_TOKEN_ESTIMATE']) + 20
 
         if not current_batch or (current_batch_tokens + article_tokens) <= token_budget:
             current_batch.append(row)
@@ -111,19 +147,26 @@ def create_dynamic_batches(rows: list, token_budget: int) -> list:
     logging.info(f"Dynamically created {len(batches)} batches from {len(rows)} articles.")
     return batches
 
+def fetch_batch_texts(cursor: sqlite3.Cursor, batch: list) -> list:
+    """Fetches (rowid, filename, text) for a planned batch, truncated SQL-side."""
+    rowids = [rowid for rowid, _ in batch]
+    placeholders = ",".join("?" * len(rowids))
+    query = f"""SELECT rowid, filename, substr(pagetext, 1, ?) FROM scraped_content
+                WHERE rowid IN ({placeholders})"""
+    return cursor.execute(query, [CONFIG['max_text_length_per_article'], *rowids]).fetchall()
+
 def analyze_batch_of_articles(batch: list) -> dict | None:
     """
     Constructs a single prompt for a batch of articles and calls the LLM API.
     """
     prompt_texts, article_ids = [], {}
     for rowid, _, text in batch:
-        if not isinstance(text, str) or len(text.strip()) < 100:
+        if not isinstance(text, str) or len(text.strip()) < CONFIG['min_text_length_per_article']:
             continue
         
         article_id = f"article_{rowid}"
         article_ids[rowid] = article_id
-        truncated_text = text[:CONFIG['max_text_length_per_article']]
-        prompt_texts.append(f"--- ARTICLE {article_id} ---\n{truncated_text}\n")
+        prompt_texts.append(f"--- ARTICLE {article_id} ---\n{text}\n")
 
     if not prompt_texts:
         return {}
@@ -152,7 +195,12 @@ def main():
     setup_database(cursor)
     conn.commit()
 
-    query = f"SELECT rowid, filename, pagetext FROM scraped_content WHERE technical_depth IS NULL LIMIT {CONFIG['DB_PROCESSING_LIMIT']}"
+    # Served entirely from the partial index: no table scan and no text loaded.
+    # Rows come back shortest-first (index order). Rows too short to analyze are
+    # excluded here, otherwise they would never be updated and would be picked first on every run.
+    query = f"""SELECT rowid, text_length FROM scraped_content
+                WHERE technical_depth IS NULL AND text_length >= {CONFIG['min_text_length_per_article']}
+                LIMIT {CONFIG['DB_PROCESSING_LIMIT']}"""
     rows_to_process = cursor.execute(query).fetchall()
 
     if not rows_to_process:
@@ -167,7 +215,7 @@ def main():
 
     for i, batch in enumerate(all_batches, 1):
         logging.info(f"--- Processing Batch {i}/{total_batches} ({len(batch)} articles) ---")
-        batch_results = analyze_batch_of_articles(batch)
+        batch_results = analyze_batch_of_articles(fetch_batch_texts(cursor, batch))
 
         if batch_results:
             logging.info(f"Successfully received analysis for {len(batch_results)} articles in the batch.")
@@ -0,0 +1,334 @@
+"""Batch transcription worker for mp4tosrt.sh.
+
+Loads the whisper model once and reuses it for every video in a folder.
+Audio is decoded by ffmpeg straight into memory through a pipe, so no
+temporary .wav files are written. Videos that already have an .srt newer
+than the video are skipped.
+
+With --long, silence is dropped using an energy-based voice activity
+detector and the remaining speech is transcribed in parallel by a pool of
+CPU worker processes, each holding its own copy of the model. Results are
+stitched back into one .srt on the original timeline.
+"""
+
+import argparse
+import gc
+import multiprocessing
+import os
+import subprocess
+
+import numpy as np
+import whisper
+
+SAMPLE_RATE = 16000
+VAD_FRAME_SECONDS = 0.03
+PIECE_GAP_SECONDS = 0.2
+
+_worker_model = None
+_worker_error = None
+
+def load_audio(file_path, sample_rate=SAMPLE_RATE):
+    """Decode the audio track of a file to mono float32 samples via an ffmpeg pipe."""
+    cmd = [
+        'ffmpeg', '-nostdin', '-loglevel', 'error',
+        '-i', file_path,
+        '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-ac', '1', '-ar', str(sample_rate),
+        '-'
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+
+def format_timestamp(seconds):
+    """Format seconds as an SRT timestamp (HH:MM:SS,mmm)."""
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+def write_srt(segments, srt_path):
+    """Write whisper segments to an SRT file, numbering cues from 1."""
+    with open(srt_path, 'w', encoding='utf-8') as file:
+        for index, segment in enumerate(segments, 1):
+            file.write(f"{index}\n")
+            file.write(f"{format_timestamp(segment['start'])} --> {format_timestamp(segment['end'])}\n")
+            file.write(f"{segment['text'].strip().replace('-->', '->')}\n\n")
+
+def srt_is_current(video_path, srt_path):
+    """Return True if the .srt exists and is at least as new as the video."""
+    return os.path.exists(srt_path) and os.path.getmtime(srt_path) >= os.path.getmtime(video_path)
+
+def find_videos(folder, force=False):
+    """List .mp4 files in a folder that still need an .srt."""
+    pending = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith('.mp4'):
+            continue
+        video_path = os.path.join(folder, name)
+        srt_path = os.path.splitext(video_path)[0] + '.srt'
+        if not force and srt_is_current(video_path, srt_path):
+            print(f"SRT for {name} is up to date. Skipping.")
+            continue
+        pending.append((video_path, srt_path))
+    return pending
+
+def transcribe_file(model, video_path, srt_path, language=None):
+    """Transcribe one video with an already loaded model and save the .srt."""
+    audio = load_audio(video_path)
+    result = model.transcribe(audio, language=language)
+    write_srt(result['segments'], srt_path)
+
+def frame_energy_db(audio, sample_rate=SAMPLE_RATE):
+    """Return the RMS energy in dBFS of each VAD frame of the audio."""
+    frame_length = int(VAD_FRAME_SECONDS * sample_rate)
+    frame_count = len(audio) // frame_length
+    frames = audio[:frame_count * frame_length].reshape(frame_count, frame_length)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+def detect_speech(energy_db, audio_length, threshold_db=-40.0, min_silence=0.5, min_speech=0.25, padding=0.2, sample_rate=SAMPLE_RATE):
+    """
+    Find speech regions from per-frame energies (see frame_energy_db).
+    Returns a list of (start_sample, end_sample) pairs. Gaps shorter than
+    min_silence are bridged, regions shorter than min_speech are dropped and
+    each region is padded so word edges are not clipped.
+    """
+    frame_length = int(VAD_FRAME_SECONDS * sample_rate)
+    if len(energy_db) == 0:
+        return []
+    voiced = energy_db > threshold_db
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], voiced.astype(np.int8), [0]))))
+    regions = [[int(start), int(end)] for start, end in zip(edges[0::2], edges[1::2])]
+
+    max_gap = int(min_silence / VAD_FRAME_SECONDS)
+    merged = []
+    for region in regions:
+        if merged and region[0] - merged[-1][1] < max_gap:
+            merged[-1][1] = region[1]
+        else:
+            merged.append(region)
+
+    min_frames = int(min_speech / VAD_FRAME_SECONDS)
+    pad = int(padding * sample_rate)
+    speech = []
+    for start, end in merged:
+        if end - start < min_frames:
+            continue
+        start_sample = max(0, start * frame_length - pad)
+        end_sample = min(audio_length, end * frame_length + pad)
+        if speech and start_sample <= speech[-1][1]:
+            speech[-1] = (speech[-1][0], end_sample)
+        else:
+            speech.append((start_sample, end_sample))
+    return speech
+
+def quietest_cut(energy_db, start, limit, search_window=5.0, sample_rate=SAMPLE_RATE):
+    """
+    Pick a sample in (start, limit] to split a long speech region at: the
+    middle of the lowest-energy frame in the last search_window seconds
+    before limit, so the cut lands in a pause rather than inside a word.
+    """
+    frame_length = int(VAD_FRAME_SECONDS * sample_rate)
+    last_frame = min(limit // frame_length, len(energy_db))
+    first_frame = max(start // frame_length + 1, last_frame - int(search_window / VAD_FRAME_SECONDS))
+    if first_frame >= last_frame:
+        return limit
+    frame = first_frame + int(np.argmin(energy_db[first_frame:last_frame]))
+    return frame * frame_length + frame_length // 2
+
+def pack_segments(regions, energy_db, max_segment=120.0, sample_rate=SAMPLE_RATE):
+    """
+    Pack consecutive speech regions into segments of at most max_segment seconds,
+    counting the PIECE_GAP_SECONDS of silence placed between pieces. A region that
+    does not fit starts a new segment; one longer than max_segment is split at its
+    quietest frame near the limit. Each segment is a list of (start_sample,
+    end_sample) pieces that are joined by build_segment_audio for transcription.
+    """
+    max_samples = int(max_segment * sample_rate)
+    gap = int(PIECE_GAP_SECONDS * sample_rate)
+    segments = []
+    current, current_samples = [], 0
+    for start, end in regions:
+        while start < end:
+            room = max_samples - current_samples - (gap if current else 0)
+            if current and end - start > room:
+                segments.append(current)
+                current, current_samples = [], 0
+                continue
+            if end - start <= room:
+                piece_end = end
+            else:
+                piece_end = quietest_cut(energy_db, start, start + room, sample_rate=sample_rate)
+            if current:
+                current_samples += gap
+            current.append((start, piece_end))
+            current_samples += piece_end - start
+            start = piece_end
+    if current:
+        segments.append(current)
+    return segments
+
+def build_segment_audio(audio, pieces, sample_rate=SAMPLE_RATE):
+    """Join the pieces of one packed segment with short silences between them."""
+    silence = np.zeros(int(PIECE_GAP_SECONDS * sample_rate), dtype=audio.dtype)
+    parts = []
+    for index, (start, end) in enumerate(pieces):
+        if index:
+            parts.append(silence)
+        parts.append(audio[start:end])
+    return np.concatenate(parts)
+
+def to_original_time(seconds, pieces, sample_rate=SAMPLE_RATE):
+    """
+    Map a time in a joined segment back onto the original recording.
+    Times inside the silence between two pieces map to the start of the next piece.
+    """
+    gap = int(PIECE_GAP_SECONDS * sample_rate)
+    position = seconds * sample_rate
+    offset = 0
+    for start, end in pieces:
+        length = end - start
+        if position <= offset + length:
+            return (start + max(0, position - offset)) / sample_rate
+        offset += length + gap
+    return pieces[-1][1] / sample_rate
+
+def preload_model(model_name):
+    """
+    Load the model once in the parent and drop it, so a bad model name or a
+    failed download is reported before any worker starts, and workers only
+    load a checkpoint that is already on disk.
+    """
+    model = whisper.load_model(model_name, device='cpu')
+    del model
+    gc.collect()
+
+def _init_worker(model_name, threads):
+    """
+    Load the model once in each worker process.
+    A failure is kept and raised from the first task instead of escaping the
+    initializer, which would make the pool respawn workers forever.
+    """
+    global _worker_model, _worker_error
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        _worker_model = whisper.load_model(model_name, device='cpu')
+    except Exception as e:
+        _worker_error = f"{type(e).__name__}: {e}"
+
+def _check_worker():
+    """Raise in the worker if its model failed to load."""
+    if _worker_error is not None:
+        raise RuntimeError(f"Worker failed to load the model: {_worker_error}")
+
+def _detect_language(audio):
+    """Detect the spoken language of one packed segment in a worker."""
+    _check_worker()
+    if not _worker_model.is_multilingual:
+        return 'en'
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), _worker_model.dims.n_mels)
+    _, probs = _worker_model.detect_language(mel.to(_worker_model.device))
+    return max(probs, key=probs.get)
+
+def _transcribe_segment(task):
+    """Transcribe one packed segment in a worker and return its raw segments."""
+    _check_worker()
+    audio, language = task
+    result = _worker_model.transcribe(audio, language=language, fp16=False)
+    return [{'start': s['start'], 'end': s['end'], 'text': s['text']} for s in result['segments']]
+
+def transcribe_long_file(pool, video_path, srt_path, language=None, max_segment=120.0, threshold_db=-40.0):
+    """Transcribe one long recording on the worker pool, skipping silence."""
+    audio = load_audio(video_path)
+    energy_db = frame_energy_db(audio)
+    regions = detect_speech(energy_db, len(audio), threshold_db=threshold_db)
+    if not regions:
+        print(f"No speech detected in {video_path}.")
+        write_srt([], srt_path)
+        return
+
+    speech_seconds = sum(end - start for start, end in regions) / SAMPLE_RATE
+    total_seconds = len(audio) / SAMPLE_RATE
+    packed = pack_segments(regions, energy_db, max_segment)
+    print(f"Speech: {speech_seconds:.0f}s of {total_seconds:.0f}s in {len(packed)} segments.")
+
+    if language is None:
+        # Detect once per recording so every segment is decoded in the same language
+        language = pool.apply(_detect_language, (build_segment_audio(audio, packed[0]),))
+        print(f"Detected language: {language}")
+    # Segment audio is built only as each task is dispatched, not all up front
+    tasks = ((build_segment_audio(audio, pieces), language) for pieces in packed)
+    stitched = []
+    for pieces, segments in zip(packed, pool.imap(_transcribe_segment, tasks)):
+        for segment in segments:
+            stitched.append({
+                'start': to_original_time(segment['start'], pieces),
+                'end': to_original_time(segment['end'], pieces),
+                'text': segment['text']
+            })
+    stitched.sort(key=lambda segment: segment['start'])
+    write_srt(stitched, srt_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcribe every .mp4 in a folder to .srt, loading whisper once')
+    parser.add_argument('folder', nargs='?', default='.', help='Folder containing .mp4 files (default: current directory)')
+    parser.add_argument('--model', default='large', help='Whisper model name (default: large)')
+    parser.add_argument('--language', default=None, help='Spoken language, skips language detection if set')
+    parser.add_argument('--force', action='store_true', help='Re-transcribe videos that already have an up-to-date .srt')
+    parser.add_argument('--long', action='store_true', help='Long-audio mode: drop silence and transcribe speech in parallel on CPU')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 4), help='Worker processes in --long mode (default: CPU cores / 4)')
+    parser.add_argument('--max_segment', type=float, default=120.0, help='Max seconds of speech per segment in --long mode (default: 120)')
+    parser.add_argument('--vad_threshold', type=float, default=-40.0, help='Frame energy in dBFS counted as speech in --long mode (default: -40)')
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    pending = find_videos(args.folder, args.force)
+    if not pending:
+        print("No MP4 files need transcribing.")
+        return
+
+    if args.long:
+        try:
+            preload_model(args.model)
+        except Exception as e:
+            print(f"Error: Failed to get Whisper model '{args.model}': {e}")
+            exit(1)
+        threads = max(1, (os.cpu_count() or 1) // args.workers)
+        print(f"Starting {args.workers} workers with Whisper ({args.model} model), {threads} threads each...")
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(args.workers, initializer=_init_worker, initargs=(args.model, threads))
+        try:
+            pool.apply(_check_worker)
+        except Exception as e:
+            print(f"Error: {e}")
+            pool.terminate()
+            exit(1)
+    else:
+        print(f"Loading Whisper ({args.model} model)...")
+        model = whisper.load_model(args.model)
+
+    for video_path, srt_path in pending:
+        print(f"Transcribing {video_path}...")
+        try:
+            if args.long:
+                transcribe_long_file(pool, video_path, srt_path, args.language, args.max_segment, args.vad_threshold)
+            else:
+                transcribe_file(model, video_path, srt_path, args.language)
+        except subprocess.CalledProcessError as e:
+            print(f"Error: Failed to decode audio from {video_path}: {e.stderr.decode(errors='replace').strip()}")
+            continue
+        except Exception as e:
+            print(f"Error: Failed to transcribe {video_path}: {e}")
+            continue
+        print(f"Transcription complete. SRT file saved to {srt_path}.")
+
+    if args.long:
+        pool.close()
+        pool.join()
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,13 @@
 #!/bin/bash
 
+# Batch mode: hand the whole directory to a single Python worker that loads
+# the Whisper model once and pipes audio from ffmpeg without temporary WAVs.
+# Extra arguments are passed through (e.g. --model medium, --force).
+if [ "$1" == "--batch" ]; then
+  shift
+  exec python3 "$(dirname "$0")/mp4tosrt.py" . "$@"
+fi
+
 # Loop through all MP4 files in the current directory
 for INPUT_MP4 in *.mp4; do
   # Check if there are any MP4 files